@@ -1,12 +1,20 @@
 import os
+import hashlib
+import sqlite3
+import threading
+import time
 from fastapi import FastAPI, HTTPException, Depends, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from pydantic import BaseModel, validator
+from pydantic import BaseModel, field_validator
 from typing import List, Optional
 from datetime import datetime, timedelta
-from jose import JWTError, jwt
+import jwt
+from jwt import InvalidTokenError
 from passlib.context import CryptContext
+from cachetools import TTLCache
 import uvicorn
 
 # Security Configuration
@@ -16,10 +24,39 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
 # Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# New hashes use argon2id with the OWASP baseline (19 MiB, t=2, p=1); existing
+# bcrypt hashes still verify and are rehashed on the next successful login.
+# FAST_AUTH=1 drops argon2 to its minimum cost for CI/load tests and must
+# never be set in production or pointed at a real database.
+FAST_AUTH = os.environ.get("FAST_AUTH") == "1"
+pwd_context = CryptContext(
+    schemes=["argon2", "bcrypt"],
+    default="argon2",
+    deprecated="auto",
+    argon2__type="ID",
+    argon2__time_cost=1 if FAST_AUTH else 2,
+    argon2__memory_cost=8 if FAST_AUTH else 19456,
+    argon2__parallelism=1,
+)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-app = FastAPI(title="Note Taking API with Auth")
+# Verified tokens: sha256(token) -> (username, exp). Only successful
+# validations are stored, so a hit skips the HMAC check in jwt.decode.
+_token_cache = TTLCache(maxsize=10000, ttl=30)
+
+# Recently issued tokens: sha256(username:hashed_password) -> token. Repeat
+# logins within the TTL get the same token back instead of a fresh signature;
+# keying on the stored hash means a password change never hits an old entry.
+_issued_token_cache = TTLCache(maxsize=10000, ttl=15)
+
+# TTLCache is not thread-safe and both caches are used from threadpool handlers
+_cache_lock = threading.Lock()
+
+app = FastAPI(title="Note Taking API with Auth", default_response_class=ORJSONResponse)
+
+# Compress larger JSON bodies (e.g. the notes list). Added before CORS so
+# it sits inside it and CORS headers are applied to the compressed response.
+app.add_middleware(GZipMiddleware, minimum_size=500)
 
 # Enable CORS
 app.add_middleware(
@@ -30,9 +67,61 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# In-memory databases
-users_db = {}  # username: {username, hashed_password}
-notes_db = {}  # username: [list of notes]
+# SQLite database, shared by all uvicorn workers. Handlers touching it are
+# plain `def` so FastAPI runs them in its threadpool, each thread with its own
+# connection; waiting on another worker's write lock only blocks that thread.
+# DB_TIMEOUT is the busy timeout in seconds, generous enough that ordinary
+# write contention between workers waits rather than fails.
+DATABASE_PATH = os.environ.get("DATABASE_PATH", "notes.db")
+DB_TIMEOUT = 30.0
+
+_local = threading.local()
+
+def connect_db(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, timeout=DB_TIMEOUT)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+def get_db() -> sqlite3.Connection:
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = connect_db(DATABASE_PATH)
+    return conn
+
+def init_db(path: str) -> None:
+    conn = connect_db(path)
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS users (
+            username TEXT PRIMARY KEY,
+            hashed_password TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS notes (
+            id INTEGER NOT NULL,
+            username TEXT NOT NULL,
+            title TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            updated_at TEXT,
+            PRIMARY KEY (username, id)
+        );
+        -- Last issued note id per user, so ids stay monotonic after deletes
+        CREATE TABLE IF NOT EXISTS note_seq (
+            username TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL
+        );
+    """)
+    conn.close()
+
+init_db(DATABASE_PATH)
+
+@app.exception_handler(sqlite3.OperationalError)
+async def database_unavailable(request, exc):
+    # Usually "database is locked" after DB_TIMEOUT; worth retrying
+    return ORJSONResponse(status_code=503, content={"detail": "Database unavailable, try again"})
+
+NOTE_COLUMNS = "id, title, content, created_at, updated_at"
 
 # Pydantic Models
 class User(BaseModel):
@@ -42,16 +131,19 @@ class UserCreate(BaseModel):
     username: str
     password: str
 
-    @validator('username')
+    @field_validator('username')
+    @classmethod
     def username_must_be_valid(cls, v):
-        v = v.strip()
+        # Canonical form: handlers use the validated value as-is
+        v = v.strip().casefold()
         if len(v) < 3:
             raise ValueError('Username must be at least 3 characters')
         if len(v) > 50:
             raise ValueError('Username must be at most 50 characters')
         return v
 
-    @validator('password')
+    @field_validator('password')
+    @classmethod
     def password_must_be_strong(cls, v):
         if len(v) < 6:
             raise ValueError('Password must be at least 6 characters')
@@ -68,33 +160,19 @@ class Note(BaseModel):
     created_at: str
     updated_at: Optional[str] = None
 
-class NoteCreate(BaseModel):
-    title: str
-    content: str
-
-    @validator('title')
-    def title_not_empty(cls, v):
-        if not v.strip():
-            raise ValueError('Title cannot be empty')
-        return v.strip()
-
-    @validator('content')
-    def content_not_empty(cls, v):
-        if not v.strip():
-            raise ValueError('Content cannot be empty')
-        return v.strip()
-
-class NoteUpdate(BaseModel):
+class NoteBody(BaseModel):
     title: str
     content: str
 
-    @validator('title')
+    @field_validator('title')
+    @classmethod
     def title_not_empty(cls, v):
         if not v.strip():
             raise ValueError('Title cannot be empty')
         return v.strip()
 
-    @validator('content')
+    @field_validator('content')
+    @classmethod
     def content_not_empty(cls, v):
         if not v.strip():
             raise ValueError('Content cannot be empty')
@@ -107,10 +185,16 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+def _now_iso() -> str:
+    return datetime.utcnow().isoformat(timespec='seconds') + 'Z'
+
 def get_user(username: str):
-    if username in users_db:
-        return users_db[username]
-    return None
+    row = get_db().execute(
+        "SELECT username, hashed_password FROM users WHERE username = ?", (username,)
+    ).fetchone()
+    if row is None:
+        return None
+    return dict(row)
 
 def authenticate_user(username: str, password: str):
     user = get_user(username)
@@ -118,57 +202,100 @@ def authenticate_user(username: str, password: str):
         return False
     if not verify_password(password, user["hashed_password"]):
         return False
+    # Only upgrade legacy bcrypt hashes, and never under FAST_AUTH: passlib
+    # would also flag argon2 hashes whose cost differs from ours, and a
+    # FAST_AUTH rehash would store a minimum-cost hash.
+    if not FAST_AUTH and pwd_context.identify(user["hashed_password"]) == "bcrypt":
+        new_hash = get_password_hash(password)
+        db = get_db()
+        with db:
+            db.execute(
+                "UPDATE users SET hashed_password = ? WHERE username = ?",
+                (new_hash, username),
+            )
+        user["hashed_password"] = new_hash
     return user
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
-    to_encode = data.copy()
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
-    else:
-        expire = datetime.utcnow() + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
-    return encoded_jwt
-
-async def get_current_user(token: str = Depends(oauth2_scheme)):
-    credentials_exception = HTTPException(
+    expire = datetime.utcnow() + (expires_delta or timedelta(minutes=15))
+    return jwt.encode({**data, "exp": expire}, SECRET_KEY, algorithm=ALGORITHM)
+
+# 401 details for get_current_user; the HTTPException itself is only built
+# on the failure path so successful requests allocate nothing for it.
+_CREDENTIALS_DETAIL = "Could not validate credentials"
+_CREDENTIALS_HEADERS = {"WWW-Authenticate": "Bearer"}
+
+def credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
+        detail=_CREDENTIALS_DETAIL,
+        headers=_CREDENTIALS_HEADERS,
     )
+
+def issue_access_token(user: dict) -> str:
+    key = hashlib.sha256(f"{user['username']}:{user['hashed_password']}".encode()).digest()
+    with _cache_lock:
+        access_token = _issued_token_cache.get(key)
+    if access_token is None:
+        access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+        access_token = create_access_token(
+            data={"sub": user["username"]}, expires_delta=access_token_expires
+        )
+        with _cache_lock:
+            _issued_token_cache[key] = access_token
+    return access_token
+
+def get_current_user(token: str = Depends(oauth2_scheme)):
+    key = hashlib.sha256(token.encode()).digest()
+    with _cache_lock:
+        cached = _token_cache.get(key)
+        if cached is not None and cached[1] <= time.time():
+            _token_cache.pop(key, None)
+            cached = None
+    if cached is not None:
+        return cached[0]
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-    except JWTError:
-        raise credentials_exception
+        # Require sub and exp so every token that validates can be cached with its expiry
+        payload = jwt.decode(
+            token, SECRET_KEY, algorithms=[ALGORITHM], options={"require": ["exp", "sub"]}
+        )
+        username: str = payload["sub"]
+    except InvalidTokenError:
+        raise credentials_exception()
     user = get_user(username)
     if user is None:
-        raise credentials_exception
+        raise credentials_exception()
+    with _cache_lock:
+        _token_cache[key] = (username, payload["exp"])
     return username
 
 # Authentication Endpoints
 @app.post("/signup", response_model=User)
 def signup(user: UserCreate):
     """Register a new user"""
-    username = user.username.strip().lower()
-    if username in users_db:
+    username = user.username
+    if get_user(username) is not None:
         raise HTTPException(status_code=400, detail="Username already registered")
     
     hashed_password = get_password_hash(user.password)
-    users_db[username] = {
-        "username": username,
-        "hashed_password": hashed_password
-    }
-    notes_db[username] = []  # Initialize empty notes list for user
+    db = get_db()
+    try:
+        with db:
+            db.execute(
+                "INSERT INTO users (username, hashed_password) VALUES (?, ?)",
+                (username, hashed_password),
+            )
+            db.execute("INSERT INTO note_seq (username, last_id) VALUES (?, 0)", (username,))
+    except sqlite3.IntegrityError:
+        # Another signup claimed the name while we were hashing
+        raise HTTPException(status_code=400, detail="Username already registered")
     
     return {"username": username}
 
 @app.post("/token", response_model=Token)
 def login(form_data: OAuth2PasswordRequestForm = Depends()):
     """Login to get access token (OAuth2 form format)"""
-    username = form_data.username.strip().lower()
+    username = form_data.username.strip().casefold()
     user = authenticate_user(username, form_data.password)
     if not user:
         raise HTTPException(
@@ -176,90 +303,97 @@ def login(form_data: OAuth2PasswordRequestForm = Depends()):
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user["username"]}, expires_delta=access_token_expires
-    )
+    access_token = issue_access_token(user)
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.post("/login", response_model=Token)
 def login_json(credentials: UserCreate):
     """Login endpoint for JSON requests"""
-    username = credentials.username.strip().lower()
+    username = credentials.username
     user = authenticate_user(username, credentials.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
         )
-    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = create_access_token(
-        data={"sub": user["username"]}, expires_delta=access_token_expires
-    )
+    access_token = issue_access_token(user)
     return {"access_token": access_token, "token_type": "bearer"}
 
 # Protected Note Endpoints
 @app.get("/notes", response_model=List[Note])
 def get_all_notes(current_user: str = Depends(get_current_user)):
     """Get all notes for the current user"""
-    return notes_db.get(current_user, [])
+    rows = get_db().execute(
+        f"SELECT {NOTE_COLUMNS} FROM notes WHERE username = ? ORDER BY id", (current_user,)
+    ).fetchall()
+    return [dict(row) for row in rows]
 
 @app.post("/notes", response_model=Note)
 def create_note(
-    note: NoteCreate, 
+    note: NoteBody, 
     current_user: str = Depends(get_current_user)
 ):
     """Create a new note for the current user"""
-    user_notes = notes_db.get(current_user, [])
+    now = _now_iso()
+    db = get_db()
+    with db:
+        new_id = db.execute(
+            "UPDATE note_seq SET last_id = last_id + 1 WHERE username = ? RETURNING last_id",
+            (current_user,),
+        ).fetchone()[0]
+        db.execute(
+            "INSERT INTO notes (id, username, title, content, created_at, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?)",
+            (new_id, current_user, note.title, note.content, now, now),
+        )
     
-    new_id = max([n["id"] for n in user_notes], default=0) + 1
-    now = datetime.now().isoformat()
-    new_note = {
+    return {
         "id": new_id, 
         "title": note.title, 
         "content": note.content,
         "created_at": now,
         "updated_at": now
     }
-    
-    user_notes.append(new_note)
-    notes_db[current_user] = user_notes
-    
-    return new_note
 
 @app.get("/notes/{note_id}", response_model=Note)
 def get_note(note_id: int, current_user: str = Depends(get_current_user)):
     """Get a specific note by ID"""
-    user_notes = notes_db.get(current_user, [])
-    for note in user_notes:
-        if note["id"] == note_id:
-            return note
-    raise HTTPException(status_code=404, detail="Note not found")
+    row = get_db().execute(
+        f"SELECT {NOTE_COLUMNS} FROM notes WHERE username = ? AND id = ?",
+        (current_user, note_id),
+    ).fetchone()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Note not found")
+    return dict(row)
 
 @app.put("/notes/{note_id}", response_model=Note)
 def update_note(
     note_id: int,
-    note_update: NoteUpdate,
+    note_update: NoteBody,
     current_user: str = Depends(get_current_user)
 ):
     """Update a note by ID"""
-    user_notes = notes_db.get(current_user, [])
-    for i, note in enumerate(user_notes):
-        if note["id"] == note_id:
-            user_notes[i]["title"] = note_update.title
-            user_notes[i]["content"] = note_update.content
-            user_notes[i]["updated_at"] = datetime.now().isoformat()
-            notes_db[current_user] = user_notes
-            return user_notes[i]
-    raise HTTPException(status_code=404, detail="Note not found")
+    db = get_db()
+    with db:
+        row = db.execute(
+            "UPDATE notes SET title = ?, content = ?, updated_at = ?"
+            f" WHERE username = ? AND id = ? RETURNING {NOTE_COLUMNS}",
+            (note_update.title, note_update.content, _now_iso(),
+             current_user, note_id),
+        ).fetchone()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Note not found")
+    return dict(row)
 
 @app.delete("/notes/{note_id}")
 def delete_note(note_id: int, current_user: str = Depends(get_current_user)):
     """Delete a note by ID"""
-    user_notes = notes_db.get(current_user, [])
-    original_count = len(user_notes)
-    notes_db[current_user] = [n for n in user_notes if n["id"] != note_id]
-    if len(notes_db[current_user]) == original_count:
+    db = get_db()
+    with db:
+        deleted = db.execute(
+            "DELETE FROM notes WHERE username = ? AND id = ?", (current_user, note_id)
+        ).rowcount
+    if deleted == 0:
         raise HTTPException(status_code=404, detail="Note not found")
     return {"message": "Note deleted successfully"}
 
@@ -269,4 +403,11 @@ def read_users_me(current_user: str = Depends(get_current_user)):
     return {"username": current_user}
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="auto",
+        http="httptools",
+        workers=int(os.environ.get("WEB_CONCURRENCY", "4")),
+    )